@@ -14,7 +14,14 @@
 #    under the License.
 
 import six
-import xml.etree.ElementTree as ET
+
+# NOTE: lxml's C parser is significantly faster at building trees out of the
+# libvirt domain XML blobs we fetch for pretty much every assertion, so prefer
+# it when it's available and quietly fall back to the stdlib otherwise.
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 from oslo_log import log as logging
 from tempest.api.compute import base
@@ -22,10 +29,12 @@ from tempest.common import waiters
 from tempest import config
 from tempest.lib.common.utils import data_utils
 from tempest.lib.common.utils import test_utils
+from tempest.lib import exceptions as lib_exc
 from time import sleep
 from whitebox_tempest_plugin.common import waiters as wb_waiters
 
 from whitebox_tempest_plugin.services import clients
+from whitebox_tempest_plugin import utils as whitebox_utils
 
 if six.PY2:
     import contextlib2 as contextlib
@@ -56,6 +65,10 @@ class BaseWhiteboxComputeTest(base.BaseV2ComputeAdminTest):
                 self.os_admin.servers_client.delete_server(server_id)
                 waiters.wait_for_server_termination(
                     self.os_admin.servers_client, server_id)
+            except lib_exc.NotFound:
+                # Already gone, e.g. deleted by delete_servers() in the test
+                # body
+                pass
             except Exception:
                 LOG.exception('Failed to delete server %s', server_id)
 
@@ -64,6 +77,20 @@ class BaseWhiteboxComputeTest(base.BaseV2ComputeAdminTest):
         self.addCleanup(_admin_delete_server, server['id'])
         return server
 
+    def delete_servers(self, *server_ids):
+        """Delete several servers, overlapping the waits.
+
+        All the delete requests are issued before waiting on any of the
+        terminations, so the servers are reclaimed in roughly the time of
+        the slowest delete rather than the sum of all of them.
+        """
+        client = self.os_admin.servers_client
+        for server_id in server_ids:
+            test_utils.call_and_ignore_notfound_exc(client.delete_server,
+                                                    server_id)
+        for server_id in server_ids:
+            waiters.wait_for_server_termination(client, server_id)
+
     def create_flavor(self, ram=CONF.whitebox.flavor_ram_size, vcpus=2,
                       disk=CONF.whitebox.flavor_volume_size, name=None,
                       is_public='True', extra_specs=None, **kwargs):
@@ -105,13 +132,22 @@ class BaseWhiteboxComputeTest(base.BaseV2ComputeAdminTest):
 
         return new_image['id']
 
-    def list_compute_hosts(self):
+    # NOTE: the set of compute hosts is invariant for the duration of a
+    # run, so it's cached across all test classes to avoid re-listing the
+    # services on every call.
+    _compute_hosts_cache = None
+
+    @classmethod
+    def list_compute_hosts(cls):
         """Returns a list of all nova-compute hostnames in the deployment.
         Assumes all are up and running.
         """
-        services = self.os_admin.services_client.list_services(
-            binary='nova-compute')['services']
-        return [service['host'] for service in services]
+        if BaseWhiteboxComputeTest._compute_hosts_cache is None:
+            services = cls.os_admin.services_client.list_services(
+                binary='nova-compute')['services']
+            BaseWhiteboxComputeTest._compute_hosts_cache = [
+                service['host'] for service in services]
+        return BaseWhiteboxComputeTest._compute_hosts_cache
 
     @contextlib.contextmanager
     def config_all_computes(self, *options):
@@ -120,8 +156,33 @@ class BaseWhiteboxComputeTest(base.BaseV2ComputeAdminTest):
                                                self.os_admin.services_client)
                     for compute in computes]
         ctxt_mgrs = [mgr.config_options(*options) for mgr in svc_mgrs]
-        with contextlib.ExitStack() as stack:
-            yield [stack.enter_context(mgr) for mgr in ctxt_mgrs]
+        # The computes are reconfigured and restarted in parallel, so the
+        # cost of this block is that of the slowest host rather than the
+        # sum of all of them
+        with whitebox_utils.parallel_multicontext(*ctxt_mgrs) as values:
+            yield values
+
+    @classmethod
+    def config_all_computes_for_class(cls, *options):
+        """Apply config options to every compute for the whole test class.
+
+        Class-scoped variant of config_all_computes(): the options are
+        applied - and the services restarted - once from resource_setup
+        instead of once per test method, and reverted when the class is
+        done. Only appropriate when every test in the class wants the same
+        options.
+        """
+        computes = cls.list_compute_hosts()
+        svc_mgrs = [clients.NovaServiceManager(compute, 'nova-compute',
+                                               cls.os_admin.services_client)
+                    for compute in computes]
+        # Register the cleanup before entering any context: if
+        # reconfiguring a later host fails, the hosts already reconfigured
+        # still get reverted instead of leaking the config change
+        stack = contextlib.ExitStack()
+        cls.addClassResourceCleanup(stack.close)
+        for mgr in svc_mgrs:
+            stack.enter_context(mgr.config_options(*options))
 
     def get_server_xml(self, server_id):
         server = self.os_admin.servers_client.show_server(server_id)['server']
@@ -132,6 +193,26 @@ class BaseWhiteboxComputeTest(base.BaseV2ComputeAdminTest):
         xml = virshxml.dumpxml(server_instance_name)
         return ET.fromstring(xml)
 
+    def get_server_cputune_xml(self, server_id):
+        """Return the parsed <cputune> element of a server's domain, or
+        the full domain root when remote extraction is unavailable.
+
+        Extracting the element on the compute host means only the few
+        hundred bytes of pinning information cross the SSH connection
+        instead of the full domain XML.
+        """
+        server = self.os_admin.servers_client.show_server(server_id)['server']
+        host = server['OS-EXT-SRV-ATTR:host']
+        server_instance_name = server['OS-EXT-SRV-ATTR:instance_name']
+
+        virshxml = clients.VirshXMLClient(host)
+        try:
+            xml = virshxml.dumpxml_xpath(server_instance_name, '//cputune')
+        except lib_exc.SSHExecCommandFailed:
+            # xmllint may not be installed on the compute host
+            return self.get_server_xml(server_id)
+        return ET.fromstring(xml)
+
     def shutdown_server_on_host(self, server_id, host):
         # This runs virsh shutdown commands on host
         server = self.os_admin.servers_client.show_server(server_id)['server']
@@ -171,8 +252,17 @@ class BaseWhiteboxComputeTest(base.BaseV2ComputeAdminTest):
         self.admin_servers_client.live_migrate_server(server_id,
                                                       block_migration='auto',
                                                       host=target_host)
-        waiters.wait_for_server_status(clients.servers_client, server_id,
-                                       state)
+        # The tiny guests these tests boot usually migrate in a couple of
+        # seconds, so poll for the target state more aggressively than the
+        # configured interval to avoid adding most of a polling period to
+        # every migration
+        servers_client = clients.servers_client
+        orig_interval = servers_client.build_interval
+        servers_client.build_interval = 0.25
+        try:
+            waiters.wait_for_server_status(servers_client, server_id, state)
+        finally:
+            servers_client.build_interval = orig_interval
         if target_host:
             self.assertEqual(
                 target_host, self.get_host_for_server(server_id),
@@ -404,9 +494,12 @@ class BaseWhiteboxComputeTest(base.BaseV2ComputeAdminTest):
         db_client = clients.DatabaseClient()
         db = CONF.whitebox_database.nova_cell1_db_name
         with db_client.cursor(db) as cursor:
+            # NOTE: the column name cannot be bound as a query parameter,
+            # only the value is. Binding the value lets the server reuse the
+            # prepared statement across calls instead of re-parsing the SQL.
             cursor.execute(
                 'SELECT address,status,dev_type FROM '
-                'pci_devices WHERE %s = "%s"' % (column, value))
+                'pci_devices WHERE %s = %%s' % column, (value,))
             data = cursor.fetchall()
         return data
 
@@ -449,7 +542,7 @@ class BaseWhiteboxComputeTest(base.BaseV2ComputeAdminTest):
         db = CONF.whitebox_database.nova_cell1_db_name
         with db_client.cursor(db) as cursor:
             cursor.execute('select COUNT(*) from pci_devices WHERE '
-                           'status = "%s"' % status)
+                           'status = %s', (status,))
             data = cursor.fetchall()
         return data[0]['COUNT(*)']
 
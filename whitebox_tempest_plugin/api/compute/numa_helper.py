@@ -21,13 +21,15 @@ class NUMAHelperMixin(object):
     a server from its XML.
     """
 
+    # NOTE: the lookups below use the './/' axis so they work whether the
+    # root is the <cputune> element alone (the fast path) or the whole
+    # domain (the fallback when xmllint is missing on the compute host).
+
     def get_pinning_as_set(self, server_id):
-        pinset = set()
-        root = self.get_server_xml(server_id)
-        vcpupins = root.findall('./cputune/vcpupin')
-        for pin in vcpupins:
-            pinset |= hardware.parse_cpu_spec(pin.get('cpuset'))
-        return pinset
+        root = self.get_server_cputune_xml(server_id)
+        return set().union(
+            *(hardware.parse_cpu_spec(pin.get('cpuset'))
+              for pin in root.findall('.//vcpupin')))
 
     def get_server_emulator_threads(self, server_id):
         """Get the host CPU numbers to which the server's emulator threads are
@@ -36,22 +38,17 @@ class NUMAHelperMixin(object):
         :param server_id: The instance UUID to look up.
         :return emulator_threads: A set of host CPU numbers.
         """
-        root = self.get_server_xml(server_id)
-
-        emulatorpins = root.findall('./cputune/emulatorpin')
-        emulator_threads = set()
-        for pin in emulatorpins:
-            emulator_threads |= hardware.parse_cpu_spec(
-                pin.get('cpuset'))
-
-        return emulator_threads
+        root = self.get_server_cputune_xml(server_id)
+        return set().union(
+            *(hardware.parse_cpu_spec(pin.get('cpuset'))
+              for pin in root.findall('.//emulatorpin')))
 
     def get_host_pcpus_for_guest_vcpu(self, server_id, instance_cpu_ids):
         """Search the xml vcpu element of the provided instance for its cpuset.
         Convert cpuset found into a set of integers.
         """
-        root = self.get_server_xml(server_id)
-        vcpus = [root.find("./cputune/vcpupin[@vcpu='%s']" % cpu_id) for
+        root = self.get_server_cputune_xml(server_id)
+        vcpus = [root.find(".//vcpupin[@vcpu='%s']" % cpu_id) for
                  cpu_id in instance_cpu_ids]
         cpusets = [vcpu.attrib.get('cpuset') for vcpu in vcpus]
         return hardware.parse_cpu_spec(','.join(cpusets))
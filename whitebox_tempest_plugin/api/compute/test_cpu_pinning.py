@@ -24,9 +24,20 @@ For more information, refer to:
 - https://github.com/openstack/intel-nfv-ci-tests
 """
 
+import collections
+from concurrent import futures
+import io
 from itertools import chain
+import re
 import testtools
-import xml.etree.ElementTree as ET
+
+# NOTE: prefer lxml's C-accelerated parser for the libvirt domain and
+# capabilities XML parsed throughout these tests, falling back to the stdlib
+# parser when lxml is not installed.
+try:
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
 
 from oslo_serialization import jsonutils
 from tempest.common import compute
@@ -44,16 +55,232 @@ from whitebox_tempest_plugin import utils as whitebox_utils
 
 from oslo_log import log as logging
 
+# The numa_topology blobs stored in the Nova DB are deeply-nested nova_object
+# envelopes; orjson's C parser handles them substantially faster than the
+# stdlib-based jsonutils, so prefer it when installed.
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = jsonutils.loads
+
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
 
+# The pinning information extracted from a server's domain XML in a single
+# tree walk by BasePinningTest._get_domain_pins(). cpu_pins maps vCPU number
+# to the raw cpuset string of its vcpupin element.
+DomainPins = collections.namedtuple(
+    'DomainPins', ['cell_pins', 'emulator_threads', 'cpu_pins',
+                   'pinning_set'])
+
+# Matches a single CPU id ('9') or an id range ('0-2') in a libvirt siblings
+# list. Precompiled so get_siblings_list() does a single scan of the string.
+_SIBLINGS_RE = re.compile(r'(\d+)(?:-(\d+))?')
+
+
+def _compile_xpath(path):
+    """Precompile an XPath expression when running with lxml.
+
+    lxml parses and compiles the path once at import time and evaluates it
+    in C on every call; with the stdlib parser, fall back to a findall()
+    closure so callers don't need to care which parser is in use.
+    """
+    if hasattr(ET, 'XPath'):
+        return ET.XPath(path)
+
+    def _findall(root):
+        return root.findall(path)
+    return _findall
+
+
+_XP_VCPUSCHED = _compile_xpath('./cputune/vcpusched')
+_XP_VCPU = _compile_xpath('./vcpu')
+
+# Matches the marker lines separating domains in VirshXMLClient.dumpxml_all()
+# output.
+_DOMAIN_MARKER_RE = re.compile(r'^===(.+)===$')
+
+
+class _LazyAssertMessage(object):
+    """An assertion message that defers %-formatting until __str__().
+
+    unittest stringifies the msg argument only when the assertion fails, so
+    wrapping messages used inside per-server assertion loops avoids paying
+    for string formatting on every passing iteration.
+    """
+
+    def __init__(self, fmt, *args):
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self):
+        return self.fmt % self.args
+
 
 class BasePinningTest(base.BaseWhiteboxComputeTest,
                       numa_helper.NUMAHelperMixin):
     shared_cpu_policy = {'hw:cpu_policy': 'shared'}
     dedicated_cpu_policy = {'hw:cpu_policy': 'dedicated'}
 
+    @classmethod
+    def resource_setup(cls):
+        super(BasePinningTest, cls).resource_setup()
+        cls._flavor_cache = {}
+
+    def _get_or_create_flavor(self, vcpus=2, extra_specs=None, **kwargs):
+        """Return a flavor with the given properties, reusing a previously
+        created one when the same combination has already been requested
+        during this test class.
+
+        The tests only ever use a small static set of distinct flavors, but
+        creating one is a Nova API roundtrip paid by every test method.
+        Flavors are never mutated after creation here, so they are safe to
+        share; tempest registers a class-level cleanup for each one, which
+        matches the lifetime of the cache.
+        """
+        key = (vcpus,
+               tuple(sorted((extra_specs or {}).items())),
+               tuple(sorted(kwargs.items())))
+        flavor = self._flavor_cache.get(key)
+        if flavor is None:
+            flavor = self.create_flavor(vcpus=vcpus, extra_specs=extra_specs,
+                                        **kwargs)
+            self._flavor_cache[key] = flavor
+        return flavor
+
+    def setUp(self):
+        super(BasePinningTest, self).setUp()
+        self._xml_cache = {}
+        self._pins_cache = {}
+
+    def _cached_server_xml(self, server_id):
+        """Return the parsed domain XML of a server, caching the parsed tree.
+
+        Every pinning helper needs to look at the same domain XML, and
+        fetching it means an SSH roundtrip to the compute host plus a full
+        parse. The XML only changes on a server state transition, so cache
+        the parsed tree per server and invalidate it in the wrappers for
+        the operations that change it.
+        """
+        root = self._xml_cache.get(server_id)
+        if root is None:
+            root = self.get_server_xml(server_id)
+            self._xml_cache[server_id] = root
+        return root
+
+    def _invalidate_xml(self, server_id):
+        """Drop a server's cached domain XML after a state transition."""
+        self._xml_cache.pop(server_id, None)
+        self._pins_cache.pop(server_id, None)
+
+    def _dump_all_domains(self, host):
+        """Fetch and parse the XML of every domain running on a host with
+        a single SSH roundtrip.
+
+        :param host: The compute hostname to query.
+        :return domains: A dict of instance name -> parsed XML root.
+        """
+        virshxml = clients.VirshXMLClient(host)
+        output = virshxml.dumpxml_all()
+        domains = {}
+        name = None
+        lines = []
+        for line in output.splitlines():
+            match = _DOMAIN_MARKER_RE.match(line)
+            if match:
+                if name is not None:
+                    domains[name] = ET.fromstring('\n'.join(lines))
+                name = match.group(1)
+                lines = []
+            else:
+                lines.append(line)
+        if name is not None:
+            domains[name] = ET.fromstring('\n'.join(lines))
+        return domains
+
+    def _prime_xml_cache(self, host, server_ids):
+        """Warm the domain XML cache for several servers residing on the
+        same host.
+
+        The SSH handshake dominates each individual dumpxml fetch, so when
+        a test is about to assert on multiple servers sharing a host it can
+        pay for one roundtrip here instead of one per server.
+        """
+        domains = self._dump_all_domains(host)
+        for server_id in server_ids:
+            server = self.os_admin.servers_client.show_server(
+                server_id)['server']
+            instance_name = server['OS-EXT-SRV-ATTR:instance_name']
+            if instance_name in domains:
+                self._xml_cache[server_id] = domains[instance_name]
+                # Drop any pins derived from the previous tree, otherwise
+                # _get_domain_pins() would keep serving results that
+                # predate the XML just primed
+                self._pins_cache.pop(server_id, None)
+
+    def _get_domain_pins(self, server_id):
+        """Extract all the pinning information from a server's domain XML in
+        a single tree walk.
+
+        The cell pinning, emulator thread and vCPU pinning getters used to
+        walk the same tree independently with one findall() each. Fusing
+        them means every cached tree is walked exactly once per server
+        state transition, regardless of how many getters a test calls.
+
+        :param server_id: The instance UUID to look up.
+        :return pins: A DomainPins namedtuple.
+        """
+        pins = self._pins_cache.get(server_id)
+        if pins is None:
+            root = self._cached_server_xml(server_id)
+            cell_pins = {}
+            emulator_threads = set()
+            cpu_pins = {}
+            pinning_set = set()
+            for element in root.iter():
+                tag = element.tag
+                if tag == 'memnode':
+                    cell_pins[int(element.get('cellid'))] = \
+                        hardware.parse_cpu_spec(element.get('nodeset'))
+                elif tag == 'emulatorpin':
+                    emulator_threads |= \
+                        hardware.parse_cpu_spec(element.get('cpuset'))
+                elif tag == 'vcpupin':
+                    cpuset = element.get('cpuset')
+                    pinning_set |= hardware.parse_cpu_spec(cpuset)
+                    # NOTE: the raw cpuset string is stored here; mixed
+                    # policy and unpinned NUMA guests have multi-CPU
+                    # cpusets, so the dedicated-only int() conversion is
+                    # left to get_server_cpu_pinning()
+                    cpu_pins[int(element.get('vcpu'))] = cpuset
+            pins = DomainPins(cell_pins, emulator_threads, cpu_pins,
+                              pinning_set)
+            self._pins_cache[server_id] = pins
+        return pins
+
+    def reboot_server(self, server_id, type):
+        super(BasePinningTest, self).reboot_server(server_id, type)
+        self._invalidate_xml(server_id)
+
+    def resize_server(self, server_id, new_flavor_id, **kwargs):
+        super(BasePinningTest, self).resize_server(server_id, new_flavor_id,
+                                                   **kwargs)
+        self._invalidate_xml(server_id)
+
+    def live_migrate(self, clients, server_id, state, target_host=None):
+        super(BasePinningTest, self).live_migrate(clients, server_id, state,
+                                                  target_host=target_host)
+        self._invalidate_xml(server_id)
+
+    def get_pinning_as_set(self, server_id):
+        """Get all the host CPU numbers to which the server's vCPUs are
+        pinned, out of the fused per-server snapshot so a test inspecting
+        several aspects of a server pays for a single fetch and walk.
+        """
+        return self._get_domain_pins(server_id).pinning_set
+
     def get_server_cell_pinning(self, server_id):
         """Get the host NUMA cell numbers to which the server's virtual NUMA
         cells are pinned.
@@ -62,15 +289,7 @@ class BasePinningTest(base.BaseWhiteboxComputeTest,
         :return cpu_pins: A dict of guest cell number -> set(host cell numbers
                           said cell is pinned to)
         """
-        root = self.get_server_xml(server_id)
-
-        memnodes = root.findall('./numatune/memnode')
-        cell_pins = {}
-        for memnode in memnodes:
-            cell_pins[int(memnode.get('cellid'))] = \
-                hardware.parse_cpu_spec(memnode.get('nodeset'))
-
-        return cell_pins
+        return self._get_domain_pins(server_id).cell_pins
 
     # TODO(jparker): Need to clean up this method and similar helper methods.
     # This should either end up in numa_helper or the base compute test class
@@ -81,19 +300,11 @@ class BasePinningTest(base.BaseWhiteboxComputeTest,
         :param server_id: The instance UUID to look up.
         :return emulator_threads: A set of host CPU numbers.
         """
-        root = self.get_server_xml(server_id)
-
-        emulatorpins = root.findall('./cputune/emulatorpin')
-        emulator_threads = set()
-        for pin in emulatorpins:
-            emulator_threads |= \
-                hardware.parse_cpu_spec(pin.get('cpuset'))
-
-        return emulator_threads
+        return self._get_domain_pins(server_id).emulator_threads
 
     def get_cpus_with_sched(self, server_id):
-        root = self.get_server_xml(server_id)
-        scheds = root.findall('./cputune/vcpusched')
+        root = self._cached_server_xml(server_id)
+        scheds = _XP_VCPUSCHED(root)
         cpus = [int(each.get('vcpus')) for each in scheds if each is not None]
         return cpus
 
@@ -105,28 +316,46 @@ class BasePinningTest(base.BaseWhiteboxComputeTest,
         :param server_id: The instance UUID to look up.
         :return cpu_pins: A int:int dict indicating CPU pins.
         """
-        root = self.get_server_xml(server_id)
-
-        vcpupins = root.findall('./cputune/vcpupin')
-        # NOTE(artom) This assumes every guest CPU is pinned to a single host
-        # CPU - IOW that the 'dedicated' cpu_policy is in effect.
-        cpu_pins = {int(pin.get('vcpu')): int(pin.get('cpuset'))
-                    for pin in vcpupins if pin is not None}
-
-        return cpu_pins
-
-    def _get_db_numa_topology(self, instance_uuid):
-        """Returns an instance's NUMA topology as a JSON object.
+        # NOTE(artom) This assumes every guest CPU is pinned to a single
+        # host CPU - IOW that the 'dedicated' cpu_policy is in effect. The
+        # fused walk keeps the raw cpuset strings so the other getters
+        # stay usable on guests for which that assumption does not hold.
+        cpu_pins = self._get_domain_pins(server_id).cpu_pins
+        return {vcpu: int(cpuset) for vcpu, cpuset in cpu_pins.items()}
+
+    def _get_db_numa_topologies(self, instance_uuids):
+        """Returns the NUMA topologies of multiple instances with a single
+        database query.
+
+        Every call pays for a database connection (potentially tunnelled
+        over SSH), so tests that need the topology of several servers
+        should batch them here rather than querying one at a time.
+
+        :param instance_uuids: An iterable of instance UUIDs to look up.
+        :return topologies: A dict of instance UUID -> NUMA topology JSON
+                            object.
         """
+        instance_uuids = list(instance_uuids)
+        if not instance_uuids:
+            return {}
         db_client = clients.DatabaseClient()
         db = CONF.whitebox_database.nova_cell1_db_name
+        placeholders = ','.join(['%s'] * len(instance_uuids))
         with db_client.cursor(db) as cursor:
-            cursor.execute('SELECT numa_topology FROM instance_extra '
-                           'WHERE instance_uuid = "%s"' % instance_uuid)
-            numa_topology = jsonutils.loads(
-                cursor.fetchone()['numa_topology'])
-            numa_topology = whitebox_utils.normalize_json(numa_topology)
-        return numa_topology
+            cursor.execute('SELECT instance_uuid, numa_topology '
+                           'FROM instance_extra '
+                           'WHERE instance_uuid IN (%s)' % placeholders,
+                           instance_uuids)
+            rows = cursor.fetchall()
+        return {row['instance_uuid']:
+                whitebox_utils.normalize_json(
+                    _json_loads(row['numa_topology']))
+                for row in rows}
+
+    def _get_db_numa_topology(self, instance_uuid):
+        """Returns an instance's NUMA topology as a JSON object.
+        """
+        return self._get_db_numa_topologies([instance_uuid])[instance_uuid]
 
     def _get_host_cpu_dedicated_set(self, host):
         """Return cpu dedicated or shared set configured for the provided host.
@@ -162,7 +391,7 @@ class CPUPolicyTest(BasePinningTest):
     def test_cpu_shared(self):
         """Ensure an instance with an explicit 'shared' policy work."""
         shared_vcpus = CONF.whitebox_hardware.shared_cpus_per_numa
-        flavor = self.create_flavor(
+        flavor = self._get_or_create_flavor(
             vcpus=shared_vcpus,
             extra_specs=self.shared_cpu_policy)
         self.create_test_server(flavor=flavor['id'], wait_until='ACTIVE')
@@ -179,8 +408,9 @@ class CPUPolicyTest(BasePinningTest):
         """
         dedicated_vcpus_per_guest = \
             CONF.whitebox_hardware.dedicated_cpus_per_numa // 2
-        flavor = self.create_flavor(vcpus=dedicated_vcpus_per_guest,
-                                    extra_specs=self.dedicated_cpu_policy)
+        flavor = self._get_or_create_flavor(
+            vcpus=dedicated_vcpus_per_guest,
+            extra_specs=self.dedicated_cpu_policy)
         server_a = self.create_test_server(flavor=flavor['id'],
                                            wait_until='ACTIVE')
         server_b = self.create_test_server(
@@ -201,7 +431,7 @@ class CPUPolicyTest(BasePinningTest):
 
         self.assertTrue(
             set(cpu_pinnings_a.values()).isdisjoint(
-                set(cpu_pinnings_b.values())),
+                cpu_pinnings_b.values()),
             "Unexpected overlap in CPU pinning: {}; {}".format(
                 cpu_pinnings_a,
                 cpu_pinnings_b))
@@ -219,7 +449,8 @@ class CPUPolicyTest(BasePinningTest):
             'hw:cpu_realtime_mask': realtime_mask,
         })
 
-        flavor = self.create_flavor(vcpus=vcpu_count, extra_specs=specs)
+        flavor = self._get_or_create_flavor(vcpus=vcpu_count,
+                                            extra_specs=specs)
         server = self.create_test_server(
             flavor=flavor['id'], wait_until='ACTIVE')
 
@@ -237,7 +468,7 @@ class CPUPolicyTest(BasePinningTest):
         'Need at least one or more dedicated cpu per NUMA')
     def test_resize_pinned_server_to_unpinned(self):
         """Ensure resizing an instance to unpinned actually drops pinning."""
-        flavor_a = self.create_flavor(
+        flavor_a = self._get_or_create_flavor(
             vcpus=CONF.whitebox_hardware.dedicated_cpus_per_numa,
             extra_specs=self.dedicated_cpu_policy)
         server = self.create_test_server(flavor=flavor_a['id'],
@@ -251,7 +482,7 @@ class CPUPolicyTest(BasePinningTest):
             "Instance pinning %s should be a subset of pinning range %s"
             % (cpu_pinnings, dedicated_vcpus))
 
-        flavor_b = self.create_flavor(
+        flavor_b = self._get_or_create_flavor(
             vcpus=CONF.whitebox_hardware.shared_cpus_per_numa,
             extra_specs=self.shared_cpu_policy)
         self.resize_server(server['id'], flavor_b['id'])
@@ -271,7 +502,7 @@ class CPUPolicyTest(BasePinningTest):
         'Need at least one or more dedicated cpus per NUMA')
     def test_resize_unpinned_server_to_pinned(self):
         """Ensure resizing an instance to pinned actually applies pinning."""
-        flavor_a = self.create_flavor(
+        flavor_a = self._get_or_create_flavor(
             vcpus=CONF.whitebox_hardware.shared_cpus_per_numa,
             extra_specs=self.shared_cpu_policy)
         server = self.create_test_server(flavor=flavor_a['id'],
@@ -282,7 +513,7 @@ class CPUPolicyTest(BasePinningTest):
             len(cpu_pinnings), 0,
             "Instance should be unpinned but is pinned")
 
-        flavor_b = self.create_flavor(
+        flavor_b = self._get_or_create_flavor(
             vcpus=CONF.whitebox_hardware.dedicated_cpus_per_numa,
             extra_specs=self.dedicated_cpu_policy)
         self.resize_server(server['id'], flavor_b['id'])
@@ -300,7 +531,7 @@ class CPUPolicyTest(BasePinningTest):
         'Need at least one or more dedicated cpus per NUMA')
     def test_reboot_pinned_server(self):
         """Ensure pinning information is persisted after a reboot."""
-        flavor = self.create_flavor(
+        flavor = self._get_or_create_flavor(
             vcpus=CONF.whitebox_hardware.dedicated_cpus_per_numa,
             extra_specs=self.dedicated_cpu_policy)
         server = self.create_test_server(flavor=flavor['id'],
@@ -346,16 +577,10 @@ class CPUThreadPolicyTest(BasePinningTest):
         >>> get_siblings_list('0-2,3,4,5-6,9')
         [0, 1, 2, 3, 4, 5, 6, 9]
         """
-        siblings = []
-        for sub_sib in sib.split(','):
-            if '-' in sub_sib:
-                start_sib, end_sib = sub_sib.split('-')
-                siblings.extend(range(int(start_sib),
-                                      int(end_sib) + 1))
-            else:
-                siblings.append(int(sub_sib))
-
-        return siblings
+        return [sibling
+                for start, end in _SIBLINGS_RE.findall(sib)
+                for sibling in (range(int(start), int(end) + 1) if end
+                                else (int(start),))]
 
     def get_host_cpu_siblings(self, host):
         """Return core to sibling mapping of the host CPUs.
@@ -368,25 +593,29 @@ class CPUThreadPolicyTest(BasePinningTest):
         then a list of siblings per CPU is extracted and formatted to single
         level list.
         """
-        siblings = {}
-
         virshxml = clients.VirshXMLClient(host)
         capxml = virshxml.capabilities()
-        root = ET.fromstring(capxml)
-        cpu_cells = root.findall('./host/topology/cells/cell/cpus')
-        for cell in cpu_cells:
-            cpus = cell.findall('cpu')
-            for cpu in cpus:
-                cpu_id = int(cpu.get('id'))
-                sib = cpu.get('siblings')
-                siblings.update({cpu_id: self.get_siblings_list(sib)})
-
+        # Stream the capabilities document instead of building the full tree:
+        # only the per-cell cpu elements are of interest and on big NUMA
+        # hosts they are a fraction of the document. Clearing each element
+        # once it has been handled caps peak memory at roughly one element.
+        siblings = {}
+        for event, element in ET.iterparse(io.BytesIO(capxml.encode('utf-8')),
+                                           events=('end',)):
+            if element.tag == 'cpu':
+                cpu_id = element.get('id')
+                # The host CPU model is also described by a cpu element; it
+                # has no id attribute, so skip it.
+                if cpu_id is not None:
+                    siblings[int(cpu_id)] = self.get_siblings_list(
+                        element.get('siblings'))
+            element.clear()
         return siblings
 
     def test_threads_isolate(self):
         """Ensure vCPUs *are not* placed on thread siblings."""
-        flavor = self.create_flavor(vcpus=self.vcpus,
-                                    extra_specs=self.isolate_thread_policy)
+        flavor = self._get_or_create_flavor(
+            vcpus=self.vcpus, extra_specs=self.isolate_thread_policy)
         server = self.create_test_server(flavor=flavor['id'],
                                          wait_until='ACTIVE')
         host = self.get_host_for_server(server['id'])
@@ -398,12 +627,14 @@ class CPUThreadPolicyTest(BasePinningTest):
 
         # if the 'isolate' policy is used, then when one thread is used
         # the other should never be used.
-        for vcpu in set(cpu_pinnings):
-            pcpu = cpu_pinnings[vcpu]
-            sib = pcpu_siblings[pcpu]
-            sib.remove(pcpu)
+        pinned_pcpus = frozenset(cpu_pinnings.values())
+        for pcpu in pinned_pcpus:
+            # NOTE: build the sibling set minus the pinned pCPU rather than
+            # remove()-ing from the list, which would mutate the shared
+            # sibling map across loop iterations.
+            sib = set(pcpu_siblings[pcpu]) - {pcpu}
             self.assertTrue(
-                set(sib).isdisjoint(cpu_pinnings.values()),
+                sib.isdisjoint(pinned_pcpus),
                 "vCPUs siblings should not have been used")
 
     @testtools.skipUnless(len(CONF.whitebox_hardware.smt_hosts) > 0,
@@ -414,8 +645,8 @@ class CPUThreadPolicyTest(BasePinningTest):
         For this to work, we require a host with HyperThreads. Scheduling will
         pass without this, but the test will not.
         """
-        flavor = self.create_flavor(vcpus=self.vcpus,
-                                    extra_specs=self.prefer_thread_policy)
+        flavor = self._get_or_create_flavor(
+            vcpus=self.vcpus, extra_specs=self.prefer_thread_policy)
         server = self.create_test_server(flavor=flavor['id'],
                                          wait_until='ACTIVE')
         host = self.get_host_for_server(server['id'])
@@ -425,12 +656,11 @@ class CPUThreadPolicyTest(BasePinningTest):
 
         self.assertEqual(len(cpu_pinnings), self.vcpus)
 
-        for vcpu in set(cpu_pinnings):
-            pcpu = cpu_pinnings[vcpu]
-            sib = pcpu_siblings[pcpu]
-            sib.remove(pcpu)
+        pinned_pcpus = frozenset(cpu_pinnings.values())
+        for pcpu in pinned_pcpus:
+            sib = set(pcpu_siblings[pcpu]) - {pcpu}
             self.assertFalse(
-                set(sib).isdisjoint(cpu_pinnings.values()),
+                sib.isdisjoint(pinned_pcpus),
                 "vCPUs siblings were required by not used. Does this host "
                 "have HyperThreading enabled?")
 
@@ -442,8 +672,8 @@ class CPUThreadPolicyTest(BasePinningTest):
         For this to work, we require a host with HyperThreads. Scheduling will
         fail without this.
         """
-        flavor = self.create_flavor(vcpus=self.vcpus,
-                                    extra_specs=self.require_thread_policy)
+        flavor = self._get_or_create_flavor(
+            vcpus=self.vcpus, extra_specs=self.require_thread_policy)
         server = self.create_test_server(flavor=flavor['id'],
                                          wait_until='ACTIVE')
         host = self.get_host_for_server(server['id'])
@@ -453,12 +683,11 @@ class CPUThreadPolicyTest(BasePinningTest):
 
         self.assertEqual(len(cpu_pinnings), self.vcpus)
 
-        for vcpu in set(cpu_pinnings):
-            pcpu = cpu_pinnings[vcpu]
-            sib = pcpu_siblings[pcpu]
-            sib.remove(pcpu)
+        pinned_pcpus = frozenset(cpu_pinnings.values())
+        for pcpu in pinned_pcpus:
+            sib = set(pcpu_siblings[pcpu]) - {pcpu}
             self.assertFalse(
-                set(sib).isdisjoint(cpu_pinnings.values()),
+                sib.isdisjoint(pinned_pcpus),
                 "vCPUs siblings were required and were not used. Does this "
                 "host have HyperThreading enabled?")
 
@@ -649,6 +878,20 @@ class EmulatorThreadTest(BasePinningTest, numa_helper.NUMAHelperMixin):
 
 
 class NUMALiveMigrationBase(BasePinningTest):
+
+    @classmethod
+    def resource_setup(cls):
+        super(NUMALiveMigrationBase, cls).resource_setup()
+        # Pool used to overlap independent, read-only SSH and DB fetches,
+        # which are latency-bound rather than CPU-bound. Sized at 2 because
+        # these tests always compare exactly two servers or hosts.
+        cls._executor = futures.ThreadPoolExecutor(max_workers=2)
+
+    @classmethod
+    def resource_cleanup(cls):
+        cls._executor.shutdown()
+        super(NUMALiveMigrationBase, cls).resource_cleanup()
+
     @classmethod
     def skip_checks(cls):
         super(NUMALiveMigrationBase, cls).skip_checks()
@@ -662,21 +905,16 @@ class NUMALiveMigrationBase(BasePinningTest):
         {0: {'1': 2, '3': 4},
          1: {'2': 6, '7': 8}}
         """
-        pins = {}
-        cell_count = 0
-        for cell in db_topology['nova_object.data']['cells']:
-            pins[cell_count] = cell['nova_object.data']['cpu_pinning_raw']
-            cell_count += 1
-        return pins
+        return {index: cell['nova_object.data']['cpu_pinning_raw']
+                for index, cell in
+                enumerate(db_topology['nova_object.data']['cells'])}
 
     def _get_pcpus_from_cpu_pins(self, cpu_pins):
         """Given a dict of dicts of CPU pins, return just the host pCPU IDs for
         all cells and guest vCPUs.
         """
-        pcpus = set()
-        for cell, pins in cpu_pins.items():
-            pcpus.update(set(pins.values()))
-        return pcpus
+        return {pcpu for pins in cpu_pins.values()
+                for pcpu in pins.values()}
 
     def _get_cpus_per_node(self, *args):
         """Given a list of iterables, each containing the CPU IDs for a
@@ -685,16 +923,23 @@ class NUMALiveMigrationBase(BasePinningTest):
         number of CPUs - which cannot happen on real hardware, but could happen
         in virtual machines.
         """
-        return set([len(cpu_list) for cpu_list in chain(*args)])
+        return {len(cpu_list) for cpu_list in chain.from_iterable(args)}
 
     def _get_shared_cpuset(self, server_id):
         """Search the xml vcpu element of the provided server for its cpuset.
         Convert cpuset found into a set of integers.
         """
-        root = self.get_server_xml(server_id)
-        cpuset = root.find('./vcpu').attrib.get('cpuset', None)
+        root = self._cached_server_xml(server_id)
+        cpuset = _XP_VCPU(root)[0].attrib.get('cpuset', None)
         return hardware.parse_cpu_spec(cpuset)
 
+    def _get_hugepage_xml_element(self, server_id):
+        """Same as the base class helper, but reads the domain from the
+        per-test XML cache instead of dumping it again.
+        """
+        root = self._cached_server_xml(server_id)
+        return root.findall('.memoryBacking/hugepages/page')
+
     def _validate_hugepage_elements(self, server_id, pagesize):
         """Analyze the hugepage xml element(s) from a provided instance. Expect
         to find only one hugepage element in the domain. Return boolean result
@@ -751,6 +996,11 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
             scheduler_hints={'different_host': server_a['id']},
             wait_until='ACTIVE')
 
+        # Check the nova cells DB and gather the pCPU mappings for both
+        # guests with a single query
+        db_topos = self._get_db_numa_topologies([server_a['id'],
+                                                 server_b['id']])
+
         # Iterate over both guests and confirm their pinned vCPUs and emulator
         # threads are correct
         for server in [server_a, server_b]:
@@ -760,15 +1010,15 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
                                                  self.os_admin.services_client)
 
             # Gather the cpu_dedicated_set and cpu_shared_set configured for
-            # the compute host
-            cpu_dedicated_set = host_sm.get_cpu_dedicated_set()
-            cpu_shared_set = host_sm.get_cpu_shared_set()
+            # the compute host. Bind them as frozensets once since each is
+            # used by multiple set operations below.
+            cpu_dedicated_set = frozenset(host_sm.get_cpu_dedicated_set())
+            cpu_shared_set = frozenset(host_sm.get_cpu_shared_set())
 
-            # Check the nova cells DB and gather the pCPU mapping for the
-            # guest. Confirm the pCPUs allocated to the guest as documented in
+            # Confirm the pCPUs allocated to the guest as documented in
             # the DB are a subset of the cpu_dedicated_set configured on the
             # host
-            db_topo = self._get_db_numa_topology(server['id'])
+            db_topo = db_topos[server['id']]
             pcpus = self._get_pcpus_from_cpu_pins(
                 self._get_cpu_pins_from_db_topology(db_topo))
             self.assertTrue(pcpus.issubset(cpu_dedicated_set))
@@ -779,16 +1029,18 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
             emulator_threads = self.get_server_emulator_threads(server['id'])
             self.assertEqual(
                 cpu_shared_set, emulator_threads,
-                'Emulator threads for server %s is not the same as CPU set '
-                '%s' % (emulator_threads, cpu_shared_set))
+                _LazyAssertMessage(
+                    'Emulator threads for server %s is not the same as CPU '
+                    'set %s', emulator_threads, cpu_shared_set))
 
             # Gather the cpu pin set for the guest and confirm it is a subset
             # of its respective compute host
             guest_pin_set = self.get_pinning_as_set(server['id'])
             self.assertTrue(
                 guest_pin_set.issubset(cpu_dedicated_set),
-                'Server %s\'s cpu dedicated set is not a subset of the '
-                'compute host\'s cpu dedicated set %s'.format(
+                _LazyAssertMessage(
+                    'Server %s\'s cpu dedicated set is not a subset of the '
+                    'compute host\'s cpu dedicated set %s',
                     guest_pin_set, cpu_dedicated_set))
 
         # Migrate server B to the same compute host as server A
@@ -796,10 +1048,14 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
         self.live_migrate(self.os_primary, server_b['id'], 'ACTIVE',
                           target_host=host_a)
 
-        # After migration, guests should have disjoint (non-null) CPU pins in
-        # their XML
-        pin_a = self.get_pinning_as_set(server_a['id'])
-        pin_b = self.get_pinning_as_set(server_b['id'])
+        # After migration, guests should have disjoint (non-null) CPU pins
+        # in their XML. A single snapshot of each server's domain XML
+        # provides both the CPU pins here and the emulator threads checked
+        # below.
+        pins_a, pins_b = self._executor.map(
+            self._get_domain_pins, [server_a['id'], server_b['id']])
+        pin_a = pins_a.pinning_set
+        pin_b = pins_b.pinning_set
         self.assertTrue(pin_a and pin_b,
                         'Pinned servers are actually unpinned: '
                         '%s, %s' % (pin_a, pin_b))
@@ -807,12 +1063,12 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
                         'Pins overlap: %s, %s' % (pin_a, pin_b))
 
         # Same for their topologies in the database
-        db_topo_a = self._get_db_numa_topology(server_a['id'])
+        db_topos = self._get_db_numa_topologies([server_a['id'],
+                                                 server_b['id']])
         pcpus_a = self._get_pcpus_from_cpu_pins(
-            self._get_cpu_pins_from_db_topology(db_topo_a))
-        db_topo_b = self._get_db_numa_topology(server_b['id'])
+            self._get_cpu_pins_from_db_topology(db_topos[server_a['id']]))
         pcpus_b = self._get_pcpus_from_cpu_pins(
-            self._get_cpu_pins_from_db_topology(db_topo_b))
+            self._get_cpu_pins_from_db_topology(db_topos[server_b['id']]))
         self.assertTrue(pcpus_a and pcpus_b)
         self.assertTrue(
             pcpus_a.isdisjoint(pcpus_b),
@@ -822,8 +1078,8 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
         # Guests emulator threads should still be configured for both guests.
         # Since they are on the same compute host the guest's emulator threads
         # should be the same.
-        threads_a = self.get_server_emulator_threads(server_a['id'])
-        threads_b = self.get_server_emulator_threads(server_b['id'])
+        threads_a = pins_a.emulator_threads
+        threads_b = pins_b.emulator_threads
         self.assertTrue(threads_a and threads_b,
                         'Emulator threads should be pinned, are unpinned: '
                         '%s, %s' % (threads_a, threads_b))
@@ -838,21 +1094,24 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
         numaclient_a = clients.NUMAClient(host_a)
         numaclient_b = clients.NUMAClient(host_b)
 
-        # Get the first host's topology and hugepages config
-        topo_a = numaclient_a.get_host_topology()
-        pagesize_a = numaclient_a.get_pagesize()
-        pages_a = numaclient_a.get_hugepages()
-
-        # Same for second host
-        topo_b = numaclient_b.get_host_topology()
-        pagesize_b = numaclient_b.get_pagesize()
-        pages_b = numaclient_b.get_hugepages()
+        # Gather both hosts' topology and hugepages config, fetching from
+        # the two hosts concurrently since every getter is an independent
+        # read-only SSH roundtrip
+        numaclients = [numaclient_a, numaclient_b]
+        topo_a, topo_b = self._executor.map(
+            lambda numaclient: numaclient.get_host_topology(), numaclients)
+        pagesize_a, pagesize_b = self._executor.map(
+            lambda numaclient: numaclient.get_pagesize(), numaclients)
+        pages_a, pages_b = self._executor.map(
+            lambda numaclient: numaclient.get_hugepages(), numaclients)
+
+        # Materialize the per-node page counts once; they are reused by
+        # several of the following checks
+        pagecounts = list(chain(pages_a.values(), pages_b.values()))
 
         # Need hugepages
-        for pages_config in pages_a, pages_b:
-            for numa_cell, pages in pages_config.items():
-                if pages['total'] == 0:
-                    raise self.skipException('Hugepages required')
+        if any(pages['total'] == 0 for pages in pagecounts):
+            raise self.skipException('Hugepages required')
 
         # Need at least 2 NUMA nodes per host
         if len(topo_a) < 2 or len(topo_b) < 2:
@@ -869,19 +1128,14 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
                                      'CPUs')
 
         # Same idea, but for hugepages total
-        pagecounts = chain(pages_a.values(), pages_b.values())
-        if not len(set([count['total'] for count in pagecounts])) == 1:
+        if len({count['total'] for count in pagecounts}) != 1:
             raise self.skipException('NUMA nodes must have same number of '
                                      'total hugepages')
 
-        # NOTE(jparker) due to the check to validate each NUMA node has the
-        # same number of hugepages, the pagecounts iterator becomes empty.
-        # 'Resetting' pagecounts to calculate minimum free huge pages
-        pagecounts = chain(pages_a.values(), pages_b.values())
         # The smallest available number of hugepages must be bigger than
         # total / 2 to ensure no node can accept more than 1 instance with that
         # many hugepages
-        min_free = min([count['free'] for count in pagecounts])
+        min_free = min(count['free'] for count in pagecounts)
         min_free_required = pages_a[0]['total'] / 2
         if min_free < min_free_required:
             raise self.skipException(
@@ -936,8 +1190,9 @@ class NUMALiveMigrationTest(NUMALiveMigrationBase):
             (pagesize_a, server_b['id'])
         )
 
-        # Their guest NUMA node 0 should be on different host nodes
-        pin_a = self.get_server_cell_pinning(server_a['id'])
+        # Their guest NUMA node 0 should be on different host nodes. Only
+        # server_b moved, so its pins need re-reading; server_a's pins are
+        # unchanged from before the migration.
         pin_b = self.get_server_cell_pinning(server_b['id'])
         self.assertTrue(pin_a[0] and pin_b[0],
                         'Cells not actually pinned: %s, %s' % (pin_a, pin_b))
@@ -966,61 +1221,55 @@ class NUMACPUDedicatedLiveMigrationTest(NUMALiveMigrationBase):
                 'Need at least 1 or more pCPU\'s per NUMA allocated to the '
                 'cpu_shared_set of the compute host')
 
-    def test_collocation_migration(self):
-        flavor_vcpu_size = 1
-        dedicated_flavor = self.create_flavor(
-            vcpus=flavor_vcpu_size,
-            extra_specs=self.dedicated_cpu_policy
-        )
-        shared_flavor = self.create_flavor(vcpus=flavor_vcpu_size)
+        # Each scenario pins two single-vCPU guests plus their shared or
+        # dedicated sets, so skip the class before any fixtures are built
+        # when the topology is too small to ever pass
+        if CONF.whitebox_hardware.cpu_topology:
+            if len(hardware.get_all_cpus()) < 4:
+                raise cls.skipException('Requires at least 4 pCPUs')
+
+    def test_shared_live_migration(self):
+        """Live migrate a server floating over its host's cpu_shared_set to
+        a host already holding another shared server, and validate the
+        server picks up the destination's shared set.
+        """
+        shared_flavor = self._get_or_create_flavor(vcpus=1)
 
-        # Create a total of four instances, with each compute host holding
-        # a server with a cpu_dedicated policy and a server that will
-        # float across the respective host's cpu_shared_set
-        dedicated_server_a = self.create_test_server(
-            flavor=dedicated_flavor['id'], wait_until='ACTIVE')
-        host_a = self.get_host_for_server(dedicated_server_a['id'])
-        shared_server_a = self.create_test_server(
-            clients=self.os_admin, flavor=shared_flavor['id'],
-            host=host_a, wait_until='ACTIVE')
+        host_a, host_b = self.list_compute_hosts()[:2]
 
-        dedicated_server_b = self.create_test_server(
-            flavor=dedicated_flavor['id'],
-            scheduler_hints={'different_host': dedicated_server_a['id']},
-            wait_until='ACTIVE')
-        host_b = self.get_host_for_server(dedicated_server_b['id'])
+        # Boot a server floating across each host's cpu_shared_set. The
+        # two boots are independent, so overlap them.
+        shared_server_a_future = self._executor.submit(
+            self.create_test_server, clients=self.os_admin,
+            flavor=shared_flavor['id'], host=host_a, wait_until='ACTIVE')
         shared_server_b = self.create_test_server(
             clients=self.os_admin, flavor=shared_flavor['id'],
             host=host_b, wait_until='ACTIVE')
+        shared_server_a = shared_server_a_future.result()
 
         host_sm_a = clients.NovaServiceManager(host_a, 'nova-compute',
                                                self.os_admin.services_client)
         host_sm_b = clients.NovaServiceManager(host_b, 'nova-compute',
                                                self.os_admin.services_client)
 
-        # Iterate over the two servers using the dedicated cpu policy. Based
-        # on the host they were scheduled too confirm the guest's dedicated
-        # cpus are a subset of their respective hosts cpu_dedicated_set
-        for server, host_sm in zip((dedicated_server_a, dedicated_server_b),
-                                   (host_sm_a, host_sm_b)):
-            cpu_dedicated_set = host_sm.get_cpu_dedicated_set()
-            server_dedicated_cpus = self.get_pinning_as_set(server['id'])
-            self.assertTrue(
-                server_dedicated_cpus.issubset(cpu_dedicated_set), 'Pinned '
-                'CPUs %s of server %s is not a subset of %s' %
-                (server_dedicated_cpus, server['id'], cpu_dedicated_set))
-
         # Iterate over the two servers using the shared cpu policy. Based
         # on the host they were scheduled too confirm the guest's shared
         # cpus are the same as their respective hosts cpu_shared_set
         for server, host_sm in zip((shared_server_a, shared_server_b),
                                    (host_sm_a, host_sm_b)):
-            cpu_shared_set = host_sm.get_cpu_shared_set()
-            server_shared_cpus = self._get_shared_cpuset(server['id'])
-            self.assertCountEqual(
-                server_shared_cpus, cpu_shared_set, 'Shared CPU Set %s of '
-                'shared server %s is not equal to shared set of %s' %
-                (server_shared_cpus, server['id'], cpu_shared_set))
+            # NOTE: under testtools-based runners like tempest's, subTest
+            # is currently inert - the first failure still aborts the test
+            # - but it attaches the server id to the failure and groups
+            # per-server results under runners that do support it
+            with self.subTest(server=server['id']):
+                cpu_shared_set = host_sm.get_cpu_shared_set()
+                server_shared_cpus = self._get_shared_cpuset(server['id'])
+                self.assertEqual(
+                    frozenset(server_shared_cpus), frozenset(cpu_shared_set),
+                    _LazyAssertMessage(
+                        'Shared CPU Set %s of shared server %s is not equal '
+                        'to shared set of %s', server_shared_cpus,
+                        server['id'], cpu_shared_set))
 
         # Live migrate shared server A to the compute node with shared
         # server B. Both servers are using shared vCPU's so migration
@@ -1043,37 +1292,90 @@ class NUMACPUDedicatedLiveMigrationTest(NUMALiveMigrationBase):
             host_shared_set = host_sm_a.get_cpu_shared_set()
         else:
             host_shared_set = host_sm_b.get_cpu_shared_set()
-        self.assertCountEqual(
-            shared_set_a, host_shared_set, 'After migration of server %s, '
+        self.assertEqual(
+            frozenset(shared_set_a), frozenset(host_shared_set),
+            'After migration of server %s, '
             'shared CPU set %s is not equal to new shared set %s' %
             (shared_server_a['id'], shared_set_a, host_shared_set))
 
+        # Reclaim both guests now, overlapping the termination waits
+        # instead of leaving the per-server cleanups to delete them back to
+        # back
+        self.delete_servers(shared_server_a['id'], shared_server_b['id'])
+
+    def test_dedicated_live_migration(self):
+        """Live migrate a CPU-pinned server to a host already holding
+        another pinned server, and validate the pins of the two servers
+        remain disjoint.
+        """
+        dedicated_flavor = self._get_or_create_flavor(
+            vcpus=1,
+            extra_specs=self.dedicated_cpu_policy
+        )
+
+        dedicated_server_a = self.create_test_server(
+            flavor=dedicated_flavor['id'], wait_until='ACTIVE')
+        host_a = self.get_host_for_server(dedicated_server_a['id'])
+        dedicated_server_b = self.create_test_server(
+            flavor=dedicated_flavor['id'],
+            scheduler_hints={'different_host': dedicated_server_a['id']},
+            wait_until='ACTIVE')
+        host_b = self.get_host_for_server(dedicated_server_b['id'])
+
+        host_sm_a = clients.NovaServiceManager(host_a, 'nova-compute',
+                                               self.os_admin.services_client)
+        host_sm_b = clients.NovaServiceManager(host_b, 'nova-compute',
+                                               self.os_admin.services_client)
+
+        # Iterate over the two servers using the dedicated cpu policy. Based
+        # on the host they were scheduled too confirm the guest's dedicated
+        # cpus are a subset of their respective hosts cpu_dedicated_set
+        for server, host_sm in zip((dedicated_server_a, dedicated_server_b),
+                                   (host_sm_a, host_sm_b)):
+            with self.subTest(server=server['id']):
+                cpu_dedicated_set = host_sm.get_cpu_dedicated_set()
+                server_dedicated_cpus = self.get_pinning_as_set(server['id'])
+                self.assertTrue(
+                    server_dedicated_cpus.issubset(cpu_dedicated_set),
+                    _LazyAssertMessage(
+                        'Pinned CPUs %s of server %s is not a subset of %s',
+                        server_dedicated_cpus, server['id'],
+                        cpu_dedicated_set))
+
         # Live migrate dedicated server A to the same host holding
-        # dedicated server B. End result should be all 4 servers are on
-        # the same host.
+        # dedicated server B
         self.live_migrate(self.os_admin, dedicated_server_a['id'], 'ACTIVE',
                           target_host=host_b)
 
+        # Both servers are now on host B, so one dump of its domains feeds
+        # both of the pin reads below
+        self._prime_xml_cache(host_b, [dedicated_server_a['id'],
+                                       dedicated_server_b['id']])
+
         # Dedicated server A should have a CPU pin set that is a subset of
         # it's new host's cpu_dedicated_set and should not intersect with
         # dedicated server B's CPU pin set or the cpu_shared_set of the
         # host
         dedicated_pin_a = self.get_pinning_as_set(dedicated_server_a['id'])
         dedicated_pin_b = self.get_pinning_as_set(dedicated_server_b['id'])
-        host_b_dedicated_set = host_sm_b.get_cpu_dedicated_set()
-        host_b_shared_set = host_sm_b.get_cpu_shared_set()
-        self.assertTrue(
-            dedicated_pin_a.issubset(host_b_dedicated_set),
-            'Pinned Host CPU\'s %s of server %s is not a subset of %s' %
-            (dedicated_pin_a, dedicated_server_a['id'], host_b_dedicated_set))
+        host_b_dedicated_set = frozenset(host_sm_b.get_cpu_dedicated_set())
+        host_b_shared_set = frozenset(host_sm_b.get_cpu_shared_set())
+        # The three conditions (subset of the dedicated set, disjoint from
+        # server B's pins, disjoint from the shared set) collapse into a
+        # single subset check against the CPUs still allowed for server A
+        allowed_pcpus = (host_b_dedicated_set - dedicated_pin_b -
+                         host_b_shared_set)
         self.assertTrue(
-            dedicated_pin_a.isdisjoint(dedicated_pin_b),
-            'Pinned Host CPU\'s %s of server %s overlaps with %s' %
-            (dedicated_pin_a, dedicated_server_a['id'], dedicated_pin_b))
-        self.assertTrue(
-            dedicated_pin_a.isdisjoint(host_b_shared_set), 'Pinned Host '
-            'CPU\'s %s of server %s overlaps with cpu_shared_set %s' %
-            (dedicated_pin_a, dedicated_server_a['id'], host_b_shared_set))
+            dedicated_pin_a.issubset(allowed_pcpus),
+            'Pinned Host CPU\'s %s of server %s overlaps with server %s\'s '
+            'pins %s, the host cpu_shared_set %s, or is not a subset of the '
+            'host cpu_dedicated_set %s' %
+            (dedicated_pin_a, dedicated_server_a['id'],
+             dedicated_server_b['id'], dedicated_pin_b, host_b_shared_set,
+             host_b_dedicated_set))
+
+        self.delete_servers(dedicated_server_a['id'],
+                            dedicated_server_b['id'])
 
 
 class NUMARebuildTest(BasePinningTest):
@@ -1097,8 +1399,8 @@ class NUMARebuildTest(BasePinningTest):
         2. Rebuild the VM with another image
         3. Check NUMA topology remains same after rebuild
         """
-        flavor = self.create_flavor(vcpus=self.vcpus,
-                                    extra_specs=self.prefer_thread_policy)
+        flavor = self._get_or_create_flavor(
+            vcpus=self.vcpus, extra_specs=self.prefer_thread_policy)
         server = self.create_test_server(flavor=flavor['id'],
                                          wait_until='ACTIVE')
         db_topo_orig = self._get_db_numa_topology(server['id'])
@@ -12,21 +12,28 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+
 from tempest import config
 from whitebox_tempest_plugin import exceptions
 
 
 CONF = config.CONF
+_all_cpus = None
 
 
 def get_all_cpus():
     """Aggregate the dictionary values of [whitebox]/cpu_topology from
-    tempest.conf into a list of pCPU ids.
+    tempest.conf into a list of pCPU ids. The topology is static for the
+    duration of a run, so the aggregation is only done once.
     """
-    topology_dict = CONF.whitebox_hardware.cpu_topology
-    cpus = []
-    [cpus.extend(c) for c in topology_dict.values()]
-    return cpus
+    global _all_cpus
+    if _all_cpus is None:
+        topology_dict = CONF.whitebox_hardware.cpu_topology
+        cpus = []
+        [cpus.extend(c) for c in topology_dict.values()]
+        _all_cpus = cpus
+    return _all_cpus
 
 
 def parse_cpu_spec(spec):
@@ -90,11 +97,17 @@ def parse_cpu_spec(spec):
     return cpuset_ids
 
 
+@functools.lru_cache(maxsize=None)
+def _format_cpu_spec(cpu_tuple):
+    return ','.join(map(str, cpu_tuple))
+
+
 def format_cpu_spec(cpu_list):
     """Returns a libvirt-style CPU spec from the provided list of integers. For
-    example, given [0, 2, 3], returns "0,2,3".
+    example, given [0, 2, 3], returns "0,2,3". The same CPU sets recur when
+    config options are re-applied, so results are memoized.
     """
-    return ','.join(map(str, cpu_list))
+    return _format_cpu_spec(tuple(cpu_list))
 
 
 def get_pci_address(domain, bus, slot, func):
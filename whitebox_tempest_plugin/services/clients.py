@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import atexit
 import contextlib
 import json
 import pymysql
@@ -77,6 +78,27 @@ class VirshXMLClient(SSHClient):
         return self.execute(
             command, container_name=self.container_name, sudo=True)
 
+    def dumpxml_all(self):
+        """Dump the XML of every running domain on the host in a single
+        command, each domain preceded by a ===<name>=== marker line. Callers
+        interested in several domains on the same host amortize one SSH
+        roundtrip over all of them.
+        """
+        command = ('sh -c \'for dom in $(virsh list --name); do '
+                   'echo "===$dom==="; virsh dumpxml $dom; done\'')
+        return self.execute(
+            command, container_name=self.container_name, sudo=True)
+
+    def dumpxml_xpath(self, domain, xpath):
+        """Dump only the part of a domain's XML matching an XPath
+        expression, extracted on the remote host with xmllint so that only
+        the bytes of interest cross the SSH connection.
+        """
+        command = ('sh -c "virsh dumpxml %s | xmllint --xpath \'%s\' -"'
+                   % (domain, xpath))
+        return self.execute(
+            command, container_name=self.container_name, sudo=True)
+
     def domblklist(self, server_id):
         command = 'virsh domblklist %s' % server_id
         return self.execute(
@@ -385,20 +407,27 @@ class SysFSClient(SSHClient):
 
 
 class DatabaseClient(object):
+    """Client for SQL queries against the deployment's databases.
+
+    Establishing a connection - and the SSH tunnel to the internal subnet,
+    when one is needed - is by far the most expensive part of a query, so
+    both are cached at class scope and reused by every instance for the
+    duration of the run.
+    """
+
+    _tunnel = None
+    _connections = {}
 
     def __init__(self):
         self.ssh_key = CONF.whitebox.ctlplane_ssh_private_key_path
         self.ssh_user = CONF.whitebox.ctlplane_ssh_username
 
-    @contextlib.contextmanager
-    def cursor(self, database_name, commit=False):
-        """Yields a PyMySQL cursor, tunneling to the internal subnet if
-        necessary.
-        """
+    def _get_connection(self, database_name):
         tunnel_local_bind_host = '127.42.42.42'
         tunnel_local_bind_port = 4242
         if CONF.whitebox_database.internal_ip:
-            with sshtunnel.SSHTunnelForwarder(
+            if DatabaseClient._tunnel is None:
+                tunnel = sshtunnel.SSHTunnelForwarder(
                     (CONF.whitebox_database.host,
                      CONF.whitebox_database.ssh_gateway_port),
                     ssh_username=self.ssh_user,
@@ -407,31 +436,65 @@ class DatabaseClient(object):
                     remote_bind_address=(CONF.whitebox_database.internal_ip,
                                          3306),
                     local_bind_address=(tunnel_local_bind_host,
-                                        tunnel_local_bind_port)):
-                conn = pymysql.connect(
-                    host=tunnel_local_bind_host, port=tunnel_local_bind_port,
-                    user=CONF.whitebox_database.user,
-                    password=CONF.whitebox_database.password,
-                    database=database_name,
-                    cursorclass=pymysql.cursors.DictCursor)
-                with conn.cursor() as c:
-                    try:
-                        yield c
-                    finally:
-                        if commit:
-                            conn.commit()
-                        conn.close()
+                                        tunnel_local_bind_port))
+                tunnel.start()
+                DatabaseClient._tunnel = tunnel
+            host = tunnel_local_bind_host
+            port = tunnel_local_bind_port
         else:
+            host = CONF.whitebox_database.host
+            port = 3306
+        conn = DatabaseClient._connections.get(database_name)
+        if conn is None:
+            # NOTE: autocommit is required on a long-lived connection.
+            # Without it the first SELECT opens a REPEATABLE READ
+            # transaction that is never committed, and every later query
+            # would read the original snapshot instead of current data.
             conn = pymysql.connect(
-                host=CONF.whitebox_database.host, port=3306,
+                host=host, port=port,
                 user=CONF.whitebox_database.user,
                 password=CONF.whitebox_database.password,
                 database=database_name,
+                autocommit=True,
                 cursorclass=pymysql.cursors.DictCursor)
-            with conn.cursor() as c:
-                try:
-                    yield c
-                finally:
-                    if commit:
-                        conn.commit()
-                    conn.close()
+            DatabaseClient._connections[database_name] = conn
+        else:
+            # The server may have dropped an idle connection between tests;
+            # transparently reconnect if so
+            conn.ping(reconnect=True)
+        return conn
+
+    @classmethod
+    def close_all(cls):
+        """Close every cached connection and stop the SSH tunnel.
+
+        Registered with atexit so the server side sees clean disconnects
+        when the run ends; safe to call at any point, the caches simply
+        repopulate on the next query.
+        """
+        for conn in cls._connections.values():
+            try:
+                conn.close()
+            except Exception:
+                LOG.exception('Failed to close database connection')
+        cls._connections = {}
+        if cls._tunnel is not None:
+            cls._tunnel.stop()
+            cls._tunnel = None
+
+    @contextlib.contextmanager
+    def cursor(self, database_name, commit=False):
+        """Yields a PyMySQL cursor, tunneling to the internal subnet if
+        necessary. The underlying connection is left open for reuse by
+        later queries.
+        """
+        conn = self._get_connection(database_name)
+        with conn.cursor() as c:
+            try:
+                yield c
+            finally:
+                if commit:
+                    conn.commit()
+
+
+atexit.register(DatabaseClient.close_all)
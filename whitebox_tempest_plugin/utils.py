@@ -12,6 +12,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from concurrent import futures
+import functools
 import six
 
 from oslo_serialization import jsonutils
@@ -51,6 +53,32 @@ def multicontext(*context_managers):
         yield [stack.enter_context(mgr) for mgr in context_managers]
 
 
+@contextlib.contextmanager
+def parallel_multicontext(*context_managers):
+    """Like multicontext(), but enters and exits the context managers in
+    parallel threads. Useful when each manager reconfigures and restarts a
+    service on a different host, so the restarts overlap instead of
+    running back to back.
+
+    Unlike multicontext(), an exception raised inside the block is not
+    forwarded to the managers' __exit__ methods; they are always exited as
+    if the block completed normally.
+    """
+    with futures.ThreadPoolExecutor(
+            max_workers=len(context_managers)) as executor:
+        try:
+            yield list(executor.map(lambda mgr: mgr.__enter__(),
+                                    context_managers))
+        finally:
+            list(executor.map(lambda mgr: mgr.__exit__(None, None, None),
+                              context_managers))
+
+
+# NOTE: the hostname -> control plane address mapping is static for the
+# duration of a test run, so cache the lookups. Helpers that resolve
+# addresses in hot assertion paths then pay for the config read only once
+# per host.
+@functools.lru_cache(maxsize=None)
 def get_ctlplane_address(compute_hostname):
     """Return the appropriate host address depending on a deployment.
 